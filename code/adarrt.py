@@ -1,55 +1,55 @@
 #!/usr/bin/env python
 
+import math
 import time
 
 import adapy
+import numba
 import numpy as np
 import rospy
 
 
+# Compiled eagerly for the state buffer's layout so the first build() does not
+# pay for JIT compilation. A prange version only pays off near the largest tree
+# sizes max_iter allows, so the loop stays serial; either way no (n, dof)
+# difference array is allocated. The fast-math flags leave out ninf and nnan,
+# under which comparisons against the running best would be undefined.
+@numba.njit(numba.intp(numba.float32[:, ::1], numba.intp, numba.float32[:]),
+            cache=True,
+            fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'})
+def _nn_argmin(states, n, sample):
+    """
+    Finds the row of states[:n] closest to sample.
+
+    :param states: (N, dof) array of node states.
+    :param n: Number of valid rows in states.
+    :param sample: The target point to find the closest row to.
+    :returns: Index of the closest row.
+    """
+    best_dist = np.finfo(np.float32).max
+    best_idx = 0
+    for i in range(n):
+        dist = np.float32(0.0)
+        for j in range(states.shape[1]):
+            d = states[i, j] - sample[j]
+            dist += d * d
+            # The partial sum only grows, so stop once it can no longer win.
+            if dist >= best_dist:
+                break
+        if dist < best_dist:
+            best_dist = dist
+            best_idx = i
+    return best_idx
+
+
 class AdaRRT():
     """
     Rapidly-Exploring Random Trees (RRT) for the ADA controller.
     """
     joint_lower_limits = np.array([-3.14, 1.57, 0.33, -3.14, 0, 0])
     joint_upper_limits = np.array([3.14, 5.00, 5.00, 3.14, 3.14, 3.14])
-
-    class Node():
-        """
-        A node for a doubly-linked tree structure.
-        """
-        def __init__(self, state, parent):
-            """
-            :param state: np.array of a state in the search space.
-            :param parent: parent Node object.
-            """
-            self.state = np.asarray(state)
-            self.parent = parent
-            self.children = []
-
-        def __iter__(self):
-            """
-            Breadth-first iterator.
-            """
-            nodelist = [self]
-            while nodelist:
-                node = nodelist.pop(0)
-                nodelist.extend(node.children)
-                yield node
-
-        def __repr__(self):
-            return 'Node({})'.format(', '.join(map(str, self.state)))
-
-        def add_child(self, state):
-            """
-            Adds a new child at the given state.
-
-            :param state: np.array of new child node's statee
-            :returns: child Node object.
-            """
-            child = AdaRRT.Node(state=state, parent=self)
-            self.children.append(child)
-            return child
+    # Maximum number of step_size steps taken towards a single sample.
+    max_extend_steps = 8
 
     def __init__(self,
                  start_state,
@@ -76,25 +76,54 @@ class AdaRRT():
         :param max_iter: Maximum number of iterations to run the RRT before
             failure.
         """
-        self.start = AdaRRT.Node(start_state, None)
-        self.goal = AdaRRT.Node(goal_state, None)
+        self.start_state = np.asarray(start_state, dtype=np.float64)
+        self.goal_state = np.asarray(goal_state, dtype=np.float64)
         self.ada = ada
-        self.joint_lower_limits = joint_lower_limits or AdaRRT.joint_lower_limits
-        self.joint_upper_limits = joint_upper_limits or AdaRRT.joint_upper_limits
+        if joint_lower_limits is None:
+            joint_lower_limits = AdaRRT.joint_lower_limits
+        if joint_upper_limits is None:
+            joint_upper_limits = AdaRRT.joint_upper_limits
+        self.joint_lower_limits = np.asarray(joint_lower_limits,
+                                             dtype=np.float32)
+        self.joint_upper_limits = np.asarray(joint_upper_limits,
+                                             dtype=np.float32)
         self.ada_collision_constraint = ada_collision_constraint
         self.step_size = step_size
         self.goal_precision = goal_precision
+        self._goal_prec_sq = goal_precision ** 2
         self.max_iter = max_iter
 
+        # The tree is stored as flat arrays indexed by node: row i of
+        # _node_states holds node i's state and _parents[i] the index of its
+        # parent (-1 for the start). _states_buf mirrors the states in
+        # float32, which is plenty to rank neighbors and halves the memory the
+        # nearest-neighbor scan reads. The buffers start with room for one
+        # node per iteration and grow when an extension chain would not fit.
+        dof = self.start_state.shape[0]
+        capacity = max_iter + AdaRRT.max_extend_steps
+        self._node_states = np.empty((capacity, dof), dtype=np.float64)
+        self._states_buf = np.empty((capacity, dof), dtype=np.float32)
+        self._parents = np.empty(capacity, dtype=np.int32)
+        self._direction = np.empty(dof, dtype=np.float64)
+        self._step_counts = np.arange(1, AdaRRT.max_extend_steps + 1,
+                                      dtype=np.float64)
+        self._n = 0
+        # Node closest to the goal so far, which goal-biased samples extend.
+        self._best_to_goal_idx = 0
+        self._best_to_goal_d2 = np.inf
+        self._node_states[0] = self.start_state
+        self._add_node(-1)
+
     def build(self):
         """
         Build an RRT.
 
         In each step of the RRT:
             1. Sample a random point.
-            2. Find its nearest neighbor.
-            3. Attempt to create a new node in the direction of sample from its
-                nearest neighbor.
+            2. Find its nearest neighbor. For samples near the goal, use the
+                node closest to the goal instead.
+            3. Attempt to create new nodes in the direction of sample from its
+                nearest neighbor, stopping at the first collision.
             4. If we have created a new node, check for completion.
 
         Once the RRT is complete, add the goal node to the RRT and build a path
@@ -103,33 +132,102 @@ class AdaRRT():
         :returns: A list of states that create a path from start to
             goal on success. On failure, returns None.
         """
+        # Draw every iteration's sample up front in a few vectorized calls.
+        near_goal = np.random.uniform(size=self.max_iter) <= 0.2
+        samples = self._get_random_sample(self.max_iter)
+        samples[near_goal] = self._get_random_sample_near_goal(
+            np.count_nonzero(near_goal))
+        # Only the nearest-neighbor query sees the float32 copy; extensions
+        # head towards the full-precision samples.
+        samples32 = samples.astype(np.float32)
+
+        # Bind everything the loop touches to locals, since it runs up to
+        # max_iter times.
+        get_nearest_neighbor = self._get_nearest_neighbor
+        extend_sample = self._extend_sample
+
         for k in range(self.max_iter):
-            if np.random.uniform() <= 0.2:
-                sample = self._get_random_sample_near_goal()
+            sample = samples[k]
+            if near_goal[k]:
+                # The node closest to the goal is almost always the nearest
+                # neighbor of a sample this close to it, so skip the scan.
+                neighbor = self._best_to_goal_idx
             else:
-                sample = self._get_random_sample()               
-            neighbor = self._get_nearest_neighbor(sample)
-            new_node = self._extend_sample(sample, neighbor)
+                neighbor = get_nearest_neighbor(samples32[k])
+            new_node, is_complete = extend_sample(sample, neighbor)
 
-            if new_node and self._check_for_completion(new_node):
+            if is_complete:
                 #new_node = self.shortcut_path(new_node) #smooth the path
                 return self._trace_path_from_start(new_node)
 
         print("Failed to find path from {0} to {1} after {2} iterations!".format(
-            self.start.state, self.goal.state, self.max_iter))
+            self.start_state, self.goal_state, self.max_iter))
 
-    def _get_random_sample(self):
+    def _get_random_sample(self, num_samples=None):
         """
         Uniformly samples the search space.
 
+        :param num_samples: Number of samples to draw at once. Defaults to a
+            single sample.
         :returns: A vector representing a randomly sampled point in the search
-            space.
+            space, or a (num_samples, dof) array of such points.
         """
         # FILL in your code here
-        return np.array([np.random.uniform(low, high) for low, high in zip(self.joint_lower_limits, self.joint_upper_limits)])
-    
-    def _get_random_sample_near_goal(self):
-        return self.goal.state + np.random.uniform(-0.05, 0.05, size=self.goal.state.shape)
+        if num_samples is None:
+            return np.random.uniform(self.joint_lower_limits,
+                                     self.joint_upper_limits)
+        return np.random.uniform(
+            self.joint_lower_limits, self.joint_upper_limits,
+            size=(num_samples, self.joint_lower_limits.shape[0]))
+
+    def _get_random_sample_near_goal(self, num_samples=None):
+        """
+        Samples the search space within 0.05 of the goal in every joint.
+
+        :param num_samples: Number of samples to draw at once. Defaults to a
+            single sample.
+        :returns: A vector near the goal state, or a (num_samples, dof) array
+            of such points.
+        """
+        if num_samples is None:
+            shape = self.goal_state.shape
+        else:
+            shape = (num_samples,) + self.goal_state.shape
+        return self.goal_state + np.random.uniform(-0.05, 0.05, size=shape)
+
+    def _add_node(self, parent):
+        """
+        Adds the state in the next free row of _node_states to the tree.
+
+        :param parent: Index of the new node's parent, or -1 for the root.
+        :returns: The squared distance from the new node to the goal.
+        """
+        idx = self._n
+        state = self._node_states[idx]
+        self._states_buf[idx] = state
+        self._parents[idx] = parent
+
+        diff = state - self.goal_state
+        dist_sq = np.dot(diff, diff)
+        if dist_sq < self._best_to_goal_d2:
+            self._best_to_goal_idx = idx
+            self._best_to_goal_d2 = dist_sq
+        self._n += 1
+        return dist_sq
+
+    def _grow_buffers(self):
+        """
+        Doubles the capacity of the flat tree buffers, keeping their contents.
+
+        The initial capacity only covers one build(), and calling build()
+        again keeps growing the same tree.
+        """
+        capacity = 2 * len(self._parents)
+        self._node_states = np.resize(self._node_states,
+                                      (capacity, self._node_states.shape[1]))
+        self._states_buf = np.resize(self._states_buf,
+                                     (capacity, self._states_buf.shape[1]))
+        self._parents = np.resize(self._parents, capacity)
 
     def _get_nearest_neighbor(self, sample):
         """
@@ -137,60 +235,75 @@ class AdaRRT():
         excluding the goal node.
 
         :param sample: The target point to find the closest neighbor to.
-        :returns: A Node object for the closest neighbor.
+        :returns: The index of the closest neighbor.
         """
         # FILL in your code here
-        return min(self.start, key=lambda node: np.linalg.norm(node.state - sample))
+        sample = np.asarray(sample, dtype=np.float32)
+        return _nn_argmin(self._states_buf, self._n, sample)
 
     def _extend_sample(self, sample, neighbor):
         """
-        Adds a new node to the RRT between neighbor and sample, at a distance
-        step_size away from neighbor. The new node is only created if it will
-        not collide with any of the collision objects (see
-        RRT._check_for_collision)
+        Adds a chain of new nodes to the RRT from neighbor towards sample,
+        each a distance step_size away from the previous one. As many steps as
+        fit before sample are taken (at least one, at most max_extend_steps).
+        The chain stops at the first node that would collide with any of the
+        collision objects (see RRT._check_for_collision), or once a node is
+        close enough for completion.
 
         :param sample: target point
-        :param neighbor: closest existing node to sample
-        :returns: The new Node object. On failure (collision), returns None.
-        """
-        # FILL in your code here
-        direction = sample - neighbor.state
-        direction = direction / np.linalg.norm(direction)
-        new_node = neighbor.state + direction * self.step_size
-
-        if not self._check_for_collision(new_node):
-            return neighbor.add_child(new_node)
-        return None
-
-    def _check_for_completion(self, node):
-        """
-        Check whether node is within self.self.goal_precision distance of the goal.
-
-        :param node: The target Node
-        :returns: Boolean indicating node is close enough for completion.
+        :param neighbor: index of the closest existing node to sample
+        :returns: A tuple of the index of the last new node and a boolean
+            indicating it is within goal_precision of the goal. On failure
+            (the first step collides), returns (None, False).
         """
         # FILL in your code here
-        return np.linalg.norm(node.state - self.goal.state) < self.goal_precision
-
-
-    def _trace_path_from_start(self, node=None):
+        direction = self._direction
+        np.subtract(sample, self._node_states[neighbor], out=direction)
+        dist = math.sqrt(np.dot(direction, direction))
+        num_steps = max(1, min(int(dist / self.step_size),
+                               AdaRRT.max_extend_steps))
+
+        if self._n + AdaRRT.max_extend_steps > len(self._parents):
+            self._grow_buffers()
+
+        # Build every candidate state in place in the next free rows, so that
+        # each accepted candidate already sits in its node's row. Rows past
+        # the first collision are overwritten by the next attempt.
+        candidates = self._node_states[self._n:self._n + num_steps]
+        np.multiply(self._step_counts[:num_steps, None], direction,
+                    out=candidates)
+        # The epsilon keeps a sample that coincides with neighbor from
+        # producing NaN states; the candidate then just repeats neighbor.
+        candidates *= self.step_size / (dist + 1e-12)
+        candidates += self._node_states[neighbor]
+
+        node = None
+        for state in candidates:
+            if self._check_for_collision(state):
+                break
+            node = self._n
+            if self._add_node(neighbor) < self._goal_prec_sq:
+                return node, True
+            neighbor = node
+        return node, False
+
+    def _trace_path_from_start(self, node):
         """
-        Traces a path from start to node, if provided, or the goal otherwise.
+        Traces a path from start to node.
 
-        :param node: The target Node at the end of the path. Defaults to
-            self.goal
-        :returns: A list of states (not Nodes!) beginning at the start state and
-            ending at the goal state.
+        :param node: Index of the target node at the end of the path.
+        :returns: A list of states beginning at the start state and ending at
+            the goal state.
         """
         # FILL in your code here
-        if node is None:
-            node = self.goal
-
         path = []
-        while node is not None:
-            path.append(node.state)
-            node = node.parent
-        return path[::-1]
+        parents = self._parents
+        while node >= 0:
+            path.append(node)
+            node = parents[node]
+        # Gather the path into one contiguous (L, dof) array; callers expect a
+        # list they can prune in place.
+        return list(self._node_states[path[::-1]])
 
     def _check_for_collision(self, sample):
         """